@@ -1,7 +1,13 @@
-from collections import Mapping as _Mapping
+try:
+    from collections.abc import Mapping as _Mapping
+except ImportError:  # Python 2
+    from collections import Mapping as _Mapping
+from collections import Counter as _Counter
 from collections import defaultdict as _defaultdict
+from collections import namedtuple as _namedtuple
 import itertools as _itertools
 
+from sklearn.base import BaseEstimator as _BaseEstimator
 from sklearn.model_selection import GridSearchCV as _GridSearchCV
 from sklearn.pipeline import Pipeline as _Pipeline
 from sklearn.pipeline import FeatureUnion as _FeatureUnion
@@ -27,87 +33,261 @@ def set_grid(estimator, **grid):
     return estimator
 
 
-def _update_grid(dest, src, prefix=None):
-    # TODO: needs docs
-    if src is None:
-        return dest
-    if prefix:
-        src = [{prefix + k: v for k, v in d.items()}
-               for d in src]
-    out = []
-    for d1, d2 in _itertools.product(dest, src):
-        out_d = d1.copy()
-        out_d.update(d2)
-        out.append(out_d)
-    return out
+# Internally, each dict of a grid is held as a _GridPart of parallel tuples of
+# parameter names and value lists, so that parts are combined by tuple
+# concatenation rather than by building dicts. Where names are repeated, the
+# last value takes precedence, as with dict.update.
+_GridPart = _namedtuple('_GridPart', 'keys values')
+_EMPTY_PART = _GridPart((), ())
+
+
+def _to_part(d):
+    return _GridPart(tuple(d), tuple(d.values()))
+
+
+def _to_dict(part):
+    # value lists may be shared internally, so give callers their own
+    return dict(zip(part.keys, [list(values) for values in part.values]))
+
+
+def _prefix_grid(grid, prefix):
+    # each distinct key is only prefixed once, as keys recur across parts
+    prefixed = {k: prefix + k for part in grid for k in part.keys}
+    return [_GridPart(tuple(prefixed[k] for k in part.keys), part.values)
+            for part in grid]
+
+
+# maps type to whether it is an estimator
+_is_estimator_type_cache = {}
+
 
+def _is_estimator(obj):
+    # parameter values are mostly of a few types, such as int and str
+    obj_type = type(obj)
+    flag = _is_estimator_type_cache.get(obj_type)
+    if flag is None:
+        flag = hasattr(obj_type, 'get_params')
+        _is_estimator_type_cache[obj_type] = flag
+    return flag
 
-def _build_param_grid(estimator):
+
+# maps estimator type to its parameter names
+_params_cache = {}
+_BASE_GET_PARAMS = getattr(_BaseEstimator.get_params, '__func__',
+                           _BaseEstimator.get_params)
+
+
+def _fast_get_params(estimator):
+    """Get the top-level parameters of estimator
+
+    The parameter names are cached per type where the type uses the default
+    :meth:`BaseEstimator.get_params`, avoiding repeated signature inspection.
+    Other types (e.g. Pipeline, whose steps are parameters) are deferred to.
+    """
+    est_type = type(estimator)
+    # compare underlying functions, as Python 2 creates a new unbound method
+    # on each access
+    get_params = getattr(est_type, 'get_params', None)
+    if (getattr(get_params, '__func__', get_params)
+            is not _BASE_GET_PARAMS):
+        return estimator.get_params()
+    names = _params_cache.get(est_type)
+    if names is None:
+        names = list(estimator.get_params(deep=False))
+        _params_cache[est_type] = names
+    return {name: getattr(estimator, name) for name in names}
+
+
+def _get_grid_state(estimator):
+    """Get an estimator's own grid parts and estimator-valued parameters"""
     grid = getattr(estimator, '_param_grid', {})
-    if isinstance(grid, _Mapping):
+    if isinstance(grid, dict) or isinstance(grid, _Mapping):
         grid = [grid]
+    grid = [_to_part(d) for d in grid]
+    sub_estimators = {param_name: value
+                      for param_name, value
+                      in _fast_get_params(estimator).items()
+                      if '__' not in param_name
+                      and _is_estimator(value)}
+    return grid, sub_estimators
+
+
+def _is_flat(grid, sub_estimators):
+    """Whether a grid is a single dict needing no expansion"""
+    return (len(grid) == 1 and not sub_estimators
+            and all(len(values) for values in grid[0].values)
+            and not any(_is_estimator(v)
+                        for values in grid[0].values for v in values))
+
+
+def _iter_nested_estimators(grid, sub_estimators):
+    for value in sub_estimators.values():
+        yield value
+    for part in grid:
+        for values in part.values:
+            for v in values:
+                if _is_estimator(v):
+                    yield v
+
+
+def _merge_parts(parts):
+    return _GridPart(tuple(k for part in parts for k in part.keys),
+                     tuple(v for part in parts for v in part.values))
+
+
+def _iter_expanded_parts(grid, sub_estimators, cache):
+    """Expand an estimator's grid given the grids of its sub-estimators
+
+    The grids of all estimators in ``sub_estimators`` and in the values of
+    ``grid`` must already be in ``cache``. Parts are generated for one dict of
+    ``grid`` at a time.
+    """
+    # prefix sub-estimator grids once, rather than for each dict in grid
+    sub_grids = []
+    for param_name, value in sub_estimators.items():
+        value_grid = cache[id(value)]
+        if value_grid is not None:
+            sub_grids.append((param_name,
+                              _prefix_grid(value_grid, param_name + '__')))
+
+    # maps (param_name, id(v)) to the parts for v's grid, as an estimator may
+    # be a value in multiple dicts of grid
+    value_parts = {}
 
-    # handle estimator parameters having their own grids
-    for param_name, value in estimator.get_params().items():
-        if '__' not in param_name and hasattr(value, 'get_params'):
-            out = []
-            value_grid = _build_param_grid(value)
-            for sub_grid in grid:
-                if param_name in sub_grid:
-                    sub_grid = [sub_grid]
-                else:
-                    sub_grid = _update_grid([sub_grid], value_grid,
-                                            param_name + '__')
-                out.extend(sub_grid)
-            grid = out
-
-    # handle grid values having their own grids
-    out = []
     for out_d in grid:
-        part = [out_d]
-        for param_name, values in out_d.items():
+        # handle estimator parameters having their own grids, unless the
+        # parameter is itself searched over
+        factors = [value_grid for param_name, value_grid in sub_grids
+                   if param_name not in out_d.keys]
+        n_sub_grids = len(factors)
+
+        # handle grid values having their own grids
+        for param_name, values in zip(out_d.keys, out_d.values):
             to_update = []
             no_sub_grid = []
             for v in values:
-                if hasattr(v, 'get_params'):
-                    sub_grid = _build_param_grid(v)
+                if _is_estimator(v):
+                    value_key = (param_name, id(v))
+                    if value_key not in value_parts:
+                        sub_grid = cache[id(v)]
+                        if sub_grid is not None:
+                            # each part selects v, with v's grid prefixed
+                            sub_grid = [
+                                _GridPart((param_name,) + part.keys,
+                                          ([v],) + part.values)
+                                for part in _prefix_grid(sub_grid,
+                                                         param_name + '__')]
+                        value_parts[value_key] = sub_grid
+                    sub_grid = value_parts[value_key]
                     if sub_grid is not None:
-                        to_update.extend(_update_grid([{param_name: [v]}],
-                                                      sub_grid,
-                                                      param_name + '__'))
+                        to_update.extend(sub_grid)
                         continue
                 no_sub_grid.append(v)
 
             if no_sub_grid:
-                to_update.append({param_name: no_sub_grid})
-
-            part = _update_grid(part, to_update)
-        out.extend(part)
-
-    if out == [{}]:
-        return None
+                to_update.append(_GridPart((param_name,), (no_sub_grid,)))
+            factors.append(to_update)
+
+        # combine all factors in a single product; sub-estimator grids take
+        # precedence over out_d, as they are merged after it
+        for parts in _itertools.product(*factors):
+            if n_sub_grids:
+                parts = parts[n_sub_grids:] + parts[:n_sub_grids]
+            yield _merge_parts(parts)
+
+
+def _build_param_grid(estimator, cache):
+    # Rather than recursing, estimators are visited in post-order using a
+    # stack, so that an estimator is expanded once all the estimators nested
+    # within it are in cache. cache maps id(estimator) to its grid, so that
+    # an estimator appearing multiple times is only expanded once.
+    stack = [(estimator, None)]
+    while stack:
+        node, state = stack.pop()
+        key = id(node)
+        if key in cache:
+            continue
+        if state is not None:
+            out = list(_iter_expanded_parts(state[0], state[1], cache))
+            if out == [_EMPTY_PART]:
+                out = None
+            cache[key] = out
+            continue
+
+        grid, sub_estimators = _get_grid_state(node)
+        if grid == [_EMPTY_PART] and not sub_estimators:
+            # nothing to search over
+            cache[key] = None
+            continue
+        if _is_flat(grid, sub_estimators):
+            cache[key] = grid
+            continue
+
+        stack.append((node, (grid, sub_estimators)))
+        stack.extend((v, None)
+                     for v in _iter_nested_estimators(grid, sub_estimators))
+
+    return cache[id(estimator)]
+
+
+def build_param_grid_iter(estimator):
+    """Generate the parameter grid annotated on the estimator, dict by dict
+
+    Unlike :func:`build_param_grid`, the dicts of the outermost grid are
+    generated one at a time, so the full list need not be held in memory.
 
-    return out
+    Parameters
+    ----------
+    estimator : scikit-learn compatible estimator
+        Should have been annotated using :func:`set_grid`
 
+    Yields
+    ------
+    dict (str -> list of values)
+        Suitable for use in :class:`sklearn.model_selection.ParameterGrid`
 
-def build_param_grid(estimator):
+    Examples
+    --------
+    >>> from sklearn.svm import SVC
+    >>> from sklearn.model_selection import ParameterGrid
+    >>> svc = set_grid(SVC(), C=[1, 10], kernel=['linear', 'rbf'])
+    >>> len(ParameterGrid(list(build_param_grid_iter(svc))))
+    4
+    """
+    cache = {}
+    grid, sub_estimators = _get_grid_state(estimator)
+    if _is_flat(grid, sub_estimators):
+        yield _to_dict(grid[0])
+        return
+    for nested in _iter_nested_estimators(grid, sub_estimators):
+        _build_param_grid(nested, cache)
+    for part in _iter_expanded_parts(grid, sub_estimators, cache):
+        yield _to_dict(part)
+
+
+def build_param_grid(estimator, sort_by_keys=False):
     """Determine the parameter grid annotated on the estimator
 
     Parameters
     ----------
     estimator : scikit-learn compatible estimator
         Should have been annotated using :func:`set_grid`
+    sort_by_keys : bool, default False
+        If True, the dicts of the grid are stably sorted by their sorted
+        parameter names, so that candidates searching the same parameters are
+        contiguous. This may improve the hit rate of a Pipeline's ``memory``
+        cache during search.
 
     Notes
     -----
     Most often, it is unnecessary for this to be used directly, and
     :func:`make_grid_search` should be used instead.
     """
-    out = _build_param_grid(estimator)
-    if out is None:
-        return {}
-    elif len(out) == 1:
+    out = list(build_param_grid_iter(estimator))
+    if len(out) == 1:
         return out[0]
+    if sort_by_keys:
+        out.sort(key=lambda d: tuple(sorted(d)))
     return out
 
 
@@ -136,6 +316,19 @@ def make_grid_search(estimator, **kwargs):
     return _GridSearchCV(estimator, build_param_grid(estimator), **kwargs)
 
 
+# maps estimator type to its lowercased name
+_name_cache = {}
+
+
+def _name_of_estimator(estimator):
+    est_type = type(estimator)
+    name = _name_cache.get(est_type)
+    if name is None:
+        name = est_type.__name__.lower()
+        _name_cache[est_type] = name
+    return name
+
+
 def _name_steps(steps, default='alt'):
     """Generate names for estimators."""
     steps = [estimators if isinstance(estimators, list) else [estimators]
@@ -147,26 +340,24 @@ def _name_steps(steps, default='alt'):
         if len(estimators) > 1:
             while None in estimators:
                 estimators.remove(None)
-        step_names = {type(estimator).__name__.lower()
-                      for estimator in estimators}
-        if len(step_names) > 1:
-            names.append(default)
-        else:
-            names.append(step_names.pop())
-
-    namecount = _defaultdict(int)
-    for name in names:
-        namecount[name] += 1
-
-    for k, v in list(namecount.items()):
-        if v == 1:
-            del namecount[k]
-
-    for i in reversed(range(len(names))):
-        name = names[i]
-        if name in namecount:
-            names[i] += "-%d" % namecount[name]
-            namecount[name] -= 1
+        # stop at the first estimator of a different type
+        step_name = None
+        for estimator in estimators:
+            name = _name_of_estimator(estimator)
+            if step_name is None:
+                step_name = name
+            elif name != step_name:
+                step_name = default
+                break
+        names.append(step_name)
+
+    # suffix repeated names in a single pass
+    totals = _Counter(names)
+    counts = _defaultdict(int)
+    for i, name in enumerate(names):
+        if totals[name] > 1:
+            counts[name] += 1
+            names[i] += "-%d" % counts[name]
 
     named_steps = list(zip(names, [step[0] for step in steps]))
     grid = {k: v for k, v in zip(names, steps) if len(v) > 1}
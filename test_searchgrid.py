@@ -1,11 +1,14 @@
+import numpy as np
 import pytest
 from sklearn.pipeline import Pipeline, FeatureUnion
 from sklearn.pipeline import make_pipeline as skl_make_pipeline
 from sklearn.svm import SVC
 from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.feature_selection import SelectKBest, SelectPercentile
+from sklearn.feature_selection import SelectFromModel
 from sklearn.datasets import load_iris
 from searchgrid import set_grid, build_param_grid, make_grid_search
+from searchgrid import build_param_grid_iter
 from searchgrid import make_pipeline, make_union
 
 
@@ -21,6 +24,22 @@ def test_build_param_grid(estimator, param_grid):
     assert build_param_grid(estimator) == param_grid
 
 
+def test_build_param_grid_array_values():
+    c_values = np.logspace(-2, 2, 5)
+    svc = set_grid(SVC(), C=c_values)
+    for estimator, key in [(svc, 'C'), (skl_make_pipeline(svc), 'svc__C')]:
+        grid = build_param_grid(estimator)
+        assert list(grid) == [key]
+        assert type(grid[key]) is list
+        assert grid[key] == c_values.tolist()
+
+
+def test_build_param_grid_not_aliased():
+    svc = set_grid(SVC(), C=[1, 2])
+    build_param_grid(svc)['C'].append(99)
+    assert svc._param_grid == {'C': [1, 2]}
+
+
 def test_build_param_grid_set_estimator():
     clf1 = SVC()
     clf2 = LogisticRegression()
@@ -39,6 +58,49 @@ def test_build_param_grid_set_estimator():
     assert build_param_grid(estimator) == param_grid
 
 
+def test_build_param_grid_repeated_estimator():
+    sel = set_grid(SelectKBest(), k=[2, 3])
+    estimator = Pipeline([('sel1', sel), ('sel2', sel), ('clf', SVC())])
+    grid = build_param_grid(estimator)
+    assert grid == {'sel1__k': [2, 3], 'sel2__k': [2, 3]}
+    assert grid['sel1__k'] is not grid['sel2__k']
+
+
+def test_build_param_grid_repeated_type():
+    # parameter values must not be shared between instances of a type
+    sel1 = SelectFromModel(set_grid(LogisticRegression(), C=[1, 2]))
+    sel2 = SelectFromModel(set_grid(SVC(), kernel=['linear']))
+    estimator = Pipeline([('sel1', sel1), ('sel2', sel2), ('clf', SVC())])
+    for _ in range(2):
+        assert build_param_grid(estimator) == {
+            'sel1__estimator__C': [1, 2],
+            'sel2__estimator__kernel': ['linear']}
+
+
+def test_build_param_grid_iter():
+    lr = set_grid(LogisticRegression(), C=[1, 2, 3])
+    svc = SVC()
+    estimator = set_grid(Pipeline([('root', lr)]), root=[lr, svc])
+    grid_iter = build_param_grid_iter(estimator)
+    assert not isinstance(grid_iter, list)
+    assert list(grid_iter) == build_param_grid(estimator)
+    assert list(build_param_grid_iter(svc)) == [{}]
+
+
+def test_build_param_grid_sort_by_keys():
+    clf1 = set_grid(SVC(), kernel=['linear'])
+    clf2 = LogisticRegression()
+    clf3 = set_grid(SVC(), kernel=['poly'], degree=[2, 3])
+    estimator = set_grid(Pipeline([('clf', None)]), clf=[clf1, clf2, clf3])
+    param_grid = build_param_grid(estimator, sort_by_keys=True)
+    assert param_grid == [{'clf': [clf2]},
+                          {'clf': [clf3], 'clf__kernel': ['poly'],
+                           'clf__degree': [2, 3]},
+                          {'clf': [clf1], 'clf__kernel': ['linear']}]
+    assert build_param_grid(estimator)[0] == {'clf': [clf1],
+                                              'clf__kernel': ['linear']}
+
+
 def test_step_estimator_grid_not_shared():
     # Fix for issue #10
     lr = set_grid(LogisticRegression(), C=[1, 2, 3])
@@ -56,6 +118,17 @@ def test_step_estimator_grid_not_shared():
     assert 'root__C' not in grid[1]
 
 
+def test_nested_alternative_grids_not_reexpanded():
+    x = set_grid(SVC(), C=[1, 2])
+    sel = SelectKBest()
+    q = set_grid(Pipeline([('a', SVC())]), a=[x, sel])
+    p = set_grid(Pipeline([('s1', SVC())]), s1=[q])
+    grid = build_param_grid(Pipeline([('s0', p)]))
+    assert grid == [{'s0__s1': [q], 's0__s1__a': [x],
+                     's0__s1__a__C': [1, 2]},
+                    {'s0__s1': [q], 's0__s1__a': [sel]}]
+
+
 def test_make_grid_search():
     X, y = load_iris(return_X_y=True)
     lr = LogisticRegression()